@@ -1,55 +1,269 @@
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from dataclasses import dataclass
+from typing import ClassVar, List, Optional, Dict, Tuple
 import trafilatura
+from trafilatura.settings import use_config
+from selectolax.lexbor import LexborHTMLParser
 import httpx
 from PyPDF2 import PdfReader
+import pypdfium2 as pdfium
 from io import BytesIO
 import asyncio
-from urllib.parse import urlparse
+import multiprocessing
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Executor, ProcessPoolExecutor
+from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit
 import re
+from cachetools import TTLCache
 
-class ContentExtractedTool(BaseModel):
+# Custom headers to appear more like a regular browser
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+# Hard caps on downloaded body size so huge responses cannot exhaust memory
+MAX_HTML_BYTES = 10 * 1024 * 1024
+MAX_PDF_BYTES = 25 * 1024 * 1024
+
+# Content types worth downloading; anything else is rejected by the HEAD preflight
+_EXTRACTABLE_CONTENT_TYPES = ('text/', 'html', 'xml', 'pdf')
+
+# Cheap sanity check for fetchable http(s) URLs
+_RE_URL = re.compile(r'^https?://[^\s/$.?#].[^\s]*$', re.IGNORECASE)
+
+# Whitespace patterns used by _trim_whitespace, compiled once at import
+_RE_NEWLINES = re.compile(r'\n{3,}')
+_RE_SPACES = re.compile(r'[^\S\n]{2,}')
+
+# Fast-path HTML extraction: main content containers and the minimum text length we
+# accept from them before falling back to trafilatura's full pipeline
+_MAIN_CONTENT_SELECTOR = 'article, main, [role=main]'
+# Scripts and page chrome that can sit inside the main container; removed before measuring its text
+_NON_CONTENT_TAGS = ['script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form']
+_MIN_FAST_PATH_CHARS = 500
+
+# trafilatura settings built once instead of re-read on every extract() call;
+# fast=True skips the readability/justext fallback extractors
+_TRAFILATURA_CONFIG = use_config()
+_TRAFILATURA_CONFIG.set('DEFAULT', 'MIN_EXTRACTED_SIZE', '250')
+_TRAFILATURA_OPTIONS = {
+    'config': _TRAFILATURA_CONFIG,
+    'fast': True,
+    'include_comments': False,
+    'include_tables': False,
+    'favor_precision': False,
+}
+
+# Successful extractions keyed by canonical URL, shared across requests
+_EXTRACTION_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+# One lock per URL so concurrent misses for the same page only fetch once; each entry
+# counts the callers holding or waiting on the lock so it is dropped only when unused
+_EXTRACTION_LOCKS: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+_EXTRACTION_WAITERS: Dict[str, int] = defaultdict(int)
+
+# Retry policy: exponential backoff with jitter, capped, honouring Retry-After. Only transient
+# failures (timeouts, connection errors, 429 and 5xx) are retried; _fetch_url_html marks them
+# with 'retryable' on the error dict
+MAX_FETCH_ATTEMPTS = 3
+MAX_RETRY_DELAY = 30
+# Limit concurrent fetches against any single host; like the URL locks, each entry counts its
+# users so hosts that are no longer being fetched are dropped
+_HOST_SEMAPHORES: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(8))
+_HOST_WAITERS: Dict[str, int] = defaultdict(int)
+# Bound concurrent fetches across all requests. Slots are held per attempt, not across the
+# backoff sleep, so a URL waiting out a Retry-After does not block other fetches
+MAX_CONCURRENT_FETCHES = 16
+_FETCH_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+
+def create_pdf_executor() -> ProcessPoolExecutor:
+    """Worker pool for PDF parsing; owned by the app lifespan, which shuts it down."""
+    # PDF parsing is CPU-bound (and PDFium is not thread-safe), so it runs in worker processes
+    # to keep the event loop free. Workers are spawned (not forked) since the app runs background threads.
+    return ProcessPoolExecutor(max_workers=os.cpu_count(),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _canonicalize_url(url: str) -> str:
+    """Normalize a URL for cache lookups: lowercase scheme/host, drop fragment, sort query."""
+    parts = urlsplit(url.strip())
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+def _extract_main_text(html: bytes, url: str, charset: Optional[str] = None) -> Optional[str]:
+    """Extract the main text of an HTML page; runs in a worker thread. Tries the page's
+    main content node with selectolax first and falls back to trafilatura."""
+    # lexbor reads bytes as UTF-8, so only decode when the page might be something else;
+    # pages in an unknown encoding go straight to trafilatura, which detects it
+    try:
+        markup = html if html.isascii() else html.decode(charset or 'utf-8')
+    except (UnicodeDecodeError, LookupError):
+        markup = None
+
+    if markup is not None:
+        tree = LexborHTMLParser(markup)
+        tree.strip_tags(_NON_CONTENT_TAGS)
+        node = tree.css_first(_MAIN_CONTENT_SELECTOR)
+        if node is not None:
+            # Keep the markup's own whitespace so inline elements stay within their sentence
+            text = node.text().strip()
+            if len(text) >= _MIN_FAST_PATH_CHARS:
+                return text
+
+    return trafilatura.extract(html, url=url, **_TRAFILATURA_OPTIONS)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Convert a Retry-After header (delay in seconds or HTTP date) into seconds to wait."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_pdf_pages_pdfium(content_bytes: bytes, max_len: int) -> Tuple[int, List[str]]:
+    """Read page text from a PDF with PDFium. Returns (page count, page texts)."""
+    pdf = pdfium.PdfDocument(content_bytes)
+    try:
+        pages = []
+        extracted_len = 0
+
+        for index in range(len(pdf)):
+            page = pdf[index]
+            # Skip pages that fail to parse instead of failing the whole document
+            try:
+                textpage = page.get_textpage()
+                text = textpage.get_text_range().replace('\r\n', '\n')
+                textpage.close()
+            except pdfium.PdfiumError:
+                continue
+            finally:
+                page.close()
+            pages.append(text)
+            extracted_len += len(text)
+            # Stop once we have comfortably more text than will be kept
+            if extracted_len > max_len * 2:
+                break
+
+        return len(pdf), pages
+    finally:
+        pdf.close()
+
+
+def _read_pdf_pages_pypdf(content_bytes: bytes, max_len: int) -> Tuple[int, List[str]]:
+    """Read page text from a PDF with PyPDF2. Returns (page count, page texts)."""
+    reader = PdfReader(BytesIO(content_bytes), strict=False)
+    pages = []
+    extracted_len = 0
+
+    for page in reader.pages:
+        # Skip pages that fail to parse instead of failing the whole document
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            continue
+        pages.append(text)
+        extracted_len += len(text)
+        # Stop once we have comfortably more text than will be kept
+        if extracted_len > max_len * 2:
+            break
+
+    return len(reader.pages), pages
+
+
+def _read_pdf_pages(content_bytes: bytes, max_len: int) -> Tuple[int, List[str]]:
+    """Read page text from a PDF; runs inside the PDF executor. Uses PDFium, falling back to PyPDF2
+    for documents PDFium refuses to open."""
+    try:
+        return _read_pdf_pages_pdfium(content_bytes, max_len)
+    except pdfium.PdfiumError:
+        return _read_pdf_pages_pypdf(content_bytes, max_len)
+
+
+@dataclass(slots=True)
+class ContentExtractedTool:
     """A tool for extracting content from URLs, handling both HTML and PDF formats."""
 
-    name: str = 'content_extractor'
-    description: str = '''
+    name: ClassVar[str] = 'content_extractor'
+    description: ClassVar[str] = '''
         A tool for performing content extraction from URLs with robust error handling.
         Supports both HTML websites and PDF documents.
     '''
 
-    async def _fetch_url_html(self, url: str, timeout: float = 15) -> Dict[str, str]:
-        """Fetch the HTML content of a URL asynchronously with comprehensive error handling."""
+    async def _preflight(self, url: str, client: httpx.AsyncClient, timeout: float = 15) -> Optional[Dict[str, str]]:
+        """Send a HEAD request and return an error dict if the resource is too large or not text/PDF."""
+        # Servers that reject or fail HEAD get the benefit of the doubt; the GET decides
+        try:
+            head = await client.head(url, timeout=timeout)
+        except httpx.HTTPError:
+            return None
+        if head.is_error:
+            return None
+
+        content_type = head.headers.get('content-type', '').lower()
+        # Many servers send PDFs as a generic binary type, so trust the .pdf extension for those
+        is_pdf = 'pdf' in content_type or (url.lower().endswith('.pdf') and 'octet-stream' in content_type)
+        # Rejections are final; fetching again would get the same answer
+        if content_type and not is_pdf and not any(kind in content_type for kind in _EXTRACTABLE_CONTENT_TYPES):
+            return {'error': f'Unsupported content type: {content_type.split(";")[0]}', 'retryable': False}
+
+        content_length = head.headers.get('content-length', '')
+        max_bytes = MAX_PDF_BYTES if is_pdf else MAX_HTML_BYTES
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            return {'error': f'Response too large. Content over {max_bytes // (1024 * 1024)} MB is not extracted.',
+                    'retryable': False}
+
+        return None
+
+    async def _fetch_url_html(self, url: str, client: httpx.AsyncClient, pdf_executor: Executor,
+                              timeout: float = 15) -> Dict[str, str]:
+        """Fetch the HTML content of a URL using the shared async client with comprehensive error handling."""
         
         # Validate URL format
-        try:
-            parsed_url = urlparse(url)
-            if not all([parsed_url.scheme, parsed_url.netloc]):
-                return {'error': 'Invalid URL format'}
-        except Exception:
+        if not _RE_URL.match(url):
             return {'error': 'Invalid URL format'}
 
-        # Custom headers to appear more like a regular browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-        }
+        # Check size and type before committing to the full download
+        rejected = await self._preflight(url, client, timeout)
+        if rejected:
+            return rejected
 
         try:
-            async with httpx.AsyncClient(timeout=timeout,
-                                       follow_redirects=True,
-                                       headers=headers) as client:
-                response = await client.get(url)
+            async with client.stream('GET', url, timeout=timeout) as response:
                 response.raise_for_status()
                 content_type = response.headers.get('content-type', '').lower()
 
-                if 'pdf' in content_type or url.lower().endswith('.pdf'):
-                    return self._extract_pdf_text(response.content)
+                is_pdf = 'pdf' in content_type or url.lower().endswith('.pdf')
+
+                # Stream the body into memory and give up once it exceeds the size cap
+                max_bytes = MAX_PDF_BYTES if is_pdf else MAX_HTML_BYTES
+                body = bytearray()
+                async for chunk in response.aiter_bytes(65536):
+                    body.extend(chunk)
+                    if len(body) > max_bytes:
+                        return {'error': f'Response too large. Content over {max_bytes // (1024 * 1024)} MB is not extracted.'}
+
+                # Hand raw bytes to the extractors instead of decoding the whole body via
+                # response.text; the header charset (if any) is passed along as a hint
+                if is_pdf:
+                    return await self._extract_pdf_text(bytes(body), pdf_executor)
                 else:
-                    return self._extract_html_text(response.text, url)
+                    return await self._extract_html_text(bytes(body), url, response.charset_encoding)
 
         except httpx.TimeoutException:
-            return {'error': 'Request timed out. The website took too long to respond.'}
+            return {'error': 'Request timed out. The website took too long to respond.', 'retryable': True}
         except httpx.TooManyRedirects:
             return {'error': 'Too many redirects. The website might be trying to prevent automated access.'}
         except httpx.HTTPStatusError as e:
@@ -59,11 +273,18 @@ class ContentExtractedTool(BaseModel):
             elif status_code == 404:
                 return {'error': 'Page not found. The URL might be invalid or the content has been removed.'}
             elif status_code == 429:
-                return {'error': 'Too many requests. The website has rate-limited our access.'}
+                return {'error': 'Too many requests. The website has rate-limited our access.',
+                        'retryable': True,
+                        'retry_after': _parse_retry_after(e.response.headers.get('retry-after'))}
             elif status_code == 503:
-                return {'error': 'Service unavailable. The website might be temporarily down or blocking automated access.'}
+                return {'error': 'Service unavailable. The website might be temporarily down or blocking automated access.',
+                        'retryable': True,
+                        'retry_after': _parse_retry_after(e.response.headers.get('retry-after'))}
             else:
-                return {'error': f'HTTP error {status_code}: The website returned an error.'}
+                return {'error': f'HTTP error {status_code}: The website returned an error.',
+                        'retryable': status_code >= 500}
+        except httpx.TransportError as e:
+            return {'error': f'Connection error: {str(e)}', 'retryable': True}
         except httpx.HTTPError as e:
             return {'error': f'Connection error: {str(e)}'}
         except Exception as e:
@@ -71,14 +292,15 @@ class ContentExtractedTool(BaseModel):
 
     def _trim_whitespace(self, text: str) -> str:
         """Utility to remove extra whitespace from text."""
-        text = re.sub(r'\n{3,}', '\n\n', text)  # Replace 3+ newlines with 2
-        text = re.sub(r'\s{2,}', ' ', text)  # Replace 2+ spaces with a single space
+        text = _RE_NEWLINES.sub('\n\n', text)  # Replace 3+ newlines with 2
+        text = _RE_SPACES.sub(' ', text)  # Replace 2+ spaces (not newlines) with a single space
         return text.strip()
 
-    def _extract_html_text(self, html: str, url: str, max_len: int = 30000) -> Dict[str, str]:
-        """Extract text from HTML content using trafilatura with error handling."""
+    async def _extract_html_text(self, html: bytes, url: str, charset: Optional[str] = None,
+                                 max_len: int = 30000) -> Dict[str, str]:
+        """Extract text from HTML content using selectolax/trafilatura (in a worker thread) with error handling."""
         try:
-            downloaded = trafilatura.extract(html, url=url)
+            downloaded = await asyncio.to_thread(_extract_main_text, html, url, charset)
             if not downloaded:
                 return {
                     'error': 'No content could be extracted. This might be due to:' + 
@@ -92,18 +314,15 @@ class ContentExtractedTool(BaseModel):
         except Exception as e:
             return {'error': f'HTML extraction error: {str(e)}'}
 
-    def _extract_pdf_text(self, content_bytes: bytes, max_len: int = 30000) -> Dict[str, str]:
-        """Extract text from PDF content using PyPDF with error handling."""
+    async def _extract_pdf_text(self, content_bytes: bytes, pdf_executor: Executor,
+                                max_len: int = 30000) -> Dict[str, str]:
+        """Extract text from PDF content using PDFium (in a worker process) with error handling."""
         try:
-            reader = PdfReader(stream=content_bytes)
-            pages = []
+            loop = asyncio.get_running_loop()
+            page_count, pages = await loop.run_in_executor(pdf_executor, _read_pdf_pages, content_bytes, max_len)
 
-            if len(reader.pages) == 0:
+            if page_count == 0:
                 return {'error': 'PDF appears to be empty'}
-
-            for page in reader.pages:
-                text = page.extract_text() or ""
-                pages.append(text)
             
             joined_text = "\n".join(pages).strip()
             if not joined_text:
@@ -114,13 +333,54 @@ class ContentExtractedTool(BaseModel):
         except Exception as e:
             return {'error': f'PDF extraction error: {str(e)}'}
 
-    async def run(self, url: str) -> Dict[str, str]:
-        """Extract content from a given URL with retry logic."""
-        # Try up to 2 times with a short delay between attempts
-        for attempt in range(2):
-            result = await self._fetch_url_html(url)
-            if not result.get('error') or attempt == 1:
+    async def _fetch_with_retry(self, url: str, client: httpx.AsyncClient, pdf_executor: Executor) -> Dict[str, str]:
+        """Fetch and extract a URL, retrying transient errors with exponential backoff."""
+        host = urlsplit(url).netloc.lower()
+        host_semaphore = _HOST_SEMAPHORES[host]
+        _HOST_WAITERS[host] += 1
+        try:
+            for attempt in range(MAX_FETCH_ATTEMPTS):
+                async with host_semaphore, _FETCH_SLOTS:
+                    result = await self._fetch_url_html(url, client, pdf_executor)
+                # Rate-limit responses tell us how long the server wants us to wait
+                retry_after = result.pop('retry_after', None)
+                # Permanent failures (4xx, bad URLs, rejected or unextractable content) fail fast
+                retryable = result.pop('retryable', False)
+                if not retryable or attempt == MAX_FETCH_ATTEMPTS - 1:
+                    return result
+                delay = max(2 ** attempt + random.random(), retry_after or 0)
+                await asyncio.sleep(min(delay, MAX_RETRY_DELAY))
+
+            return result
+        finally:
+            _HOST_WAITERS[host] -= 1
+            if not _HOST_WAITERS[host]:
+                del _HOST_WAITERS[host]
+                _HOST_SEMAPHORES.pop(host, None)
+
+    async def run(self, url: str, client: httpx.AsyncClient, pdf_executor: Executor) -> Dict[str, str]:
+        """Extract content from a given URL with retry logic, serving repeated URLs from cache."""
+        key = _canonicalize_url(url)
+        cached = _EXTRACTION_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        lock = _EXTRACTION_LOCKS[key]
+        _EXTRACTION_WAITERS[key] += 1
+        try:
+            async with lock:
+                # Another request may have filled the cache while we waited
+                cached = _EXTRACTION_CACHE.get(key)
+                if cached is not None:
+                    return cached
+
+                result = await self._fetch_with_retry(url, client, pdf_executor)
+                # Only cache successes so transient failures can be retried later
+                if not result.get('error'):
+                    _EXTRACTION_CACHE[key] = result
                 return result
-            await asyncio.sleep(1)  # Wait 1 second before retry
-            
-        return result
\ No newline at end of file
+        finally:
+            _EXTRACTION_WAITERS[key] -= 1
+            if not _EXTRACTION_WAITERS[key]:
+                del _EXTRACTION_WAITERS[key]
+                _EXTRACTION_LOCKS.pop(key, None)
\ No newline at end of file
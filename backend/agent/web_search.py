@@ -1,9 +1,11 @@
-from typing import List, Optional, Dict
-from pydantic import BaseModel, Field
+from dataclasses import dataclass
+from typing import ClassVar, List, Optional, Dict
+import httpx
 
-from serpapi.google_search import GoogleSearch
+SERPAPI_URL = 'https://serpapi.com/search'
 
-class SearchTool(BaseModel):
+@dataclass(slots=True)
+class SearchTool:
     """
         A tool for performing web searches using SerpAPI.
         Requires a SerpAPI API key.
@@ -14,32 +16,33 @@ class SearchTool(BaseModel):
             apikey (str): The SerpAPI API key for authentication.
         
         Methods:
-            _search(query: str, num_results: int) -> List[str]: Perform a web search and return the top results.
-            run(query: str, num_results: int) -> str: Run the search tool and return formatted results.
+            _search(query: str, client: httpx.AsyncClient, num_results: int) -> List[str]: Perform a web search and return the top results.
+            run(query: str, client: httpx.AsyncClient, num_results: int) -> str: Run the search tool and return formatted results.
     """
 
-    name: str = "web_search"
-    description: str = '''
+    name: ClassVar[str] = "web_search"
+    description: ClassVar[str] = '''
             A tool for performing web searches to find relevant information.
 
             Input : Input should be a search query string.
             Output: Output will be a list of relevant search result snippets.
     '''    
-    apikey: str = Field(..., description="Your SerpAPI API key.")
+    apikey: Optional[str]  # Your SerpAPI API key.
 
-    def _search(self, query: str, num_results: int = 5) -> List[str]:
-        """Perform a web search and return the top results."""
+    async def _search(self, query: str, client: httpx.AsyncClient, num_results: int = 5) -> List[str]:
+        """Perform a web search against the SerpAPI HTTP endpoint and return the top results."""
         params = {
             "engine": "google",
             "q": query,
             "api_key": self.apikey,
             "num": num_results
         }
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        response = await client.get(SERPAPI_URL, params=params)
+        results = response.json()
         
         if "error" in results:
             raise ValueError(f"SerpAPI Error: {results['error']}")
+        response.raise_for_status()
 
         urls = []
         for result in results.get("organic_results", []):
@@ -55,7 +58,7 @@ class SearchTool(BaseModel):
                 )        
         return urls
 
-    async def run(self, query: str, num_results: int = 5) -> Dict:
+    async def run(self, query: str, client: httpx.AsyncClient, num_results: int = 5) -> Dict:
         """Run the search tool with input validation."""
         try:
             if not self.apikey:
@@ -64,7 +67,7 @@ class SearchTool(BaseModel):
             if not query or len(query.strip()) < 3:
                 return "Query must be at least 3 characters long"
 
-            urls = self._search(query, num_results)
+            urls = await self._search(query, client, num_results)
             if not urls:
                 return "No results found"
                 
@@ -1,17 +1,19 @@
-from email import message
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import os
-import json
-from sqlmodel import SQLModel, Field, Session, select, Column, TIMESTAMP, text, JSON
-from typing import Optional, Dict
-from datetime import datetime
+from sqlmodel import select
+import asyncio
+import orjson
+from typing import Dict
+from pathlib import PurePosixPath
+from urllib.parse import urlsplit
 
 from backend.agent.web_search import SearchTool
 from backend.agent.content_extractor import ContentExtractedTool
 
-from backend.database.db import get_session, ReportHistory, SearchHistory
+from backend.database.db import (get_read_session, get_write_session, exclusive_write_session,
+                                 ReportHistory, SearchHistory)
 from backend.llm.get_report import ReportGenerator
 
 # Load environment variables from a .env file
@@ -22,9 +24,24 @@ router = APIRouter()
 
 # Initialize the search tool with the API key from environment variables
 serp_apikey = os.getenv('SERPAPI_API_KEY')
+search_tool = SearchTool(apikey=serp_apikey)
+extractor = ContentExtractedTool()
+
+# Links to binary media/archives never yield text, so they are not fetched at all
+_SKIP_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.ico', '.svg',
+    '.mp4', '.mp3', '.zip', '.tar', '.gz', '.exe', '.dmg',
+}
+
+def _load_links(links) -> Dict:
+    """Return report links as a dict; older rows stored them as a JSON-encoded string."""
+    if isinstance(links, str):
+        return orjson.loads(links)
+    return links or {}
+
 
 @router.get('/search')
-async def search(query: str, session: AsyncSession = Depends(get_session)):
+async def search(query: str, request: Request):
     """
     Perform a web search and extract content from results with comprehensive error handling.
     """
@@ -37,14 +54,15 @@ async def search(query: str, session: AsyncSession = Depends(get_session)):
             )
 
         # 1. Perform search with error handling
-        search_tool = SearchTool(apikey=serp_apikey)
         if not serp_apikey:
             raise HTTPException(
                 status_code=500,
                 detail="Search API key not configured"
             )
 
-        search_results = await search_tool.run(query)
+        http_client = request.app.state.http
+        pdf_executor = request.app.state.pdf_executor
+        search_results = await search_tool.run(query, http_client)
         
         if isinstance(search_results, str):  # Error case from search tool
             print(f"SearchTool error: {search_results}") 
@@ -59,23 +77,36 @@ async def search(query: str, session: AsyncSession = Depends(get_session)):
             }
 
         # 2. Extract content with error tracking
-        extractor = ContentExtractedTool()
         extracted_contents = {}
         successful_results = {}
         failed_extractions = {}
-        
+
+        to_fetch = {}
         for result_id, result in search_results.items():
-            try:
-                url = result['link']
-                content = await extractor.run(url)
-                
-                if content and not content.get('error'):
-                    extracted_contents[url] = content
-                    successful_results[result_id] = result
-                else:
-                    failed_extractions[url] = content.get('error', 'Unknown error')
-            except Exception as e:
-                failed_extractions[url] = str(e)
+            url = result.get('link', '')
+            if PurePosixPath(urlsplit(url).path).suffix.lower() in _SKIP_EXTENSIONS:
+                failed_extractions[url] = 'Skipped: not a text or PDF resource'
+            else:
+                to_fetch[result_id] = result
+
+        # Fetch all results concurrently (the extractor bounds fetches across all in-flight
+        # requests); exceptions are returned in place of results
+        fetched = await asyncio.gather(
+            *[extractor.run(result['link'], http_client, pdf_executor) for result in to_fetch.values()],
+            return_exceptions=True
+        )
+
+        for (result_id, result), content in zip(to_fetch.items(), fetched):
+            url = result.get('link', '')
+            if isinstance(content, Exception):
+                failed_extractions[url] = str(content)
+                continue
+
+            if content and not content.get('error'):
+                extracted_contents[url] = content
+                successful_results[result_id] = result
+            else:
+                failed_extractions[url] = content.get('error', 'Unknown error') if content else 'Unknown error'
 
         # 3. Prepare response based on results
         if not successful_results:
@@ -89,9 +120,9 @@ async def search(query: str, session: AsyncSession = Depends(get_session)):
 
         # 4. Store successful results in database
         try:
-            db_entry = SearchHistory(query=query)   
-            db_entry.set_search_results(successful_results)
-            db_entry.set_extracted_contents(extracted_contents)
+            db_entry = SearchHistory(query=query,
+                                     search_results=successful_results,
+                                     extracted_contents=extracted_contents)
 
             report_generator = ReportGenerator()
             results = await report_generator.generate_report(data={
@@ -99,39 +130,30 @@ async def search(query: str, session: AsyncSession = Depends(get_session)):
                                                                 "results": successful_results,
                                                                 "extracted_contents": extracted_contents
                                                             }, temperature=0.2)
-            if not isinstance(results, dict):
+            # A failed generation must not be stored as if it were a report
+            if not isinstance(results, dict) or results.get('error'):
                 raise ValueError("Report generation failed")
             
             print('Storing data in database...')
             db_report = ReportHistory(
                 title=results.get('title', f"Report for: {query}"),
-                detailed_summary=results.get('detailed_summary', 'Summary not available')
-            ) 
-            # print(results)   
-            links = results.get('links', {})
-            db_report.set_links(links)
+                detailed_summary=results.get('detailed_summary', 'Summary not available'),
+                links=results.get('links', {})
+            )
 
             # print(db_report.detailed_summary, '...')
-            # Use the session from dependency injection
-            session.add(db_entry)
-            session.add(db_report)
-            await session.commit()
+            # Only hold the writer for the insert itself; both rows go out in one transaction
+            async with exclusive_write_session() as session:
+                session.add_all([db_entry, db_report])
+                await session.commit()
+            # id and created_datetime come back from the INSERT itself (eager_defaults)
             print("✅ Report saved with ID:", db_report.id)
-            await session.refresh(db_entry)
-            await session.refresh(db_report)
-            
-            # Query the report using the same session
-            report = await session.execute(
-                select(ReportHistory.detailed_summary)
-                .where(ReportHistory.id == db_report.id))
-            
-            report_result = report.scalars().first()
-            print(json.dumps(report_result))
+
             return {
                     "id": db_report.id,
                     "title": db_report.title,
                     "detailed_summary": db_report.detailed_summary,
-                    "links": db_report.get_links(),
+                    "links": db_report.links,
                     "created_datetime": db_report.created_datetime,
                 } 
         
@@ -163,11 +185,10 @@ async def search(query: str, session: AsyncSession = Depends(get_session)):
 
 
 @router.get('/extract_content')
-def extract_content(url: str):
-    content_extract_tool = ContentExtractedTool()
+async def extract_content(url: str, request: Request):
     try:
         print('Executing Content Extraction Tool...')
-        result = content_extract_tool.run(url)
+        result = await extractor.run(url, request.app.state.http, request.app.state.pdf_executor)
         print('Content Extraction Completed.')
 
         # Check if result exists or not
@@ -175,23 +196,30 @@ def extract_content(url: str):
             raise HTTPException(status_code=404,
                                 detail='No content extracted.')
         # Check if there was an error during extraction
-        elif result['error']:
+        elif result.get('error'):
             raise HTTPException(status_code=400,
-                                detail=f'error: {result['error']}')
+                                detail=f"error: {result['error']}")
         else:
             return result
+    except HTTPException as http_ex:
+        raise http_ex
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=str(e))
 
 
 @router.get('/history')
-async def get_search_history(session: AsyncSession = Depends(get_session)):
-    """Retrieve combined search and report history."""
+async def get_search_history(limit: int = Query(50, ge=1, le=200),
+                             offset: int = Query(0, ge=0),
+                             session: AsyncSession = Depends(get_read_session)):
+    """Retrieve combined search and report history, newest first, one page at a time."""
     try:
-        # Fetch all reports
+        # Fetch one page of reports
         report_result = await session.execute(
-            select(ReportHistory).order_by(ReportHistory.created_datetime.desc())
+            select(ReportHistory)
+            .order_by(ReportHistory.created_datetime.desc())
+            .limit(limit)
+            .offset(offset)
         )
         reports = report_result.scalars().all()
 
@@ -200,7 +228,7 @@ async def get_search_history(session: AsyncSession = Depends(get_session)):
             "id": r.id,
             "query": r.title,  # use title as label
             "detailed_summary": r.detailed_summary,
-            "links": r.get_links() or {},
+            "links": _load_links(r.links),
             "created_datetime": r.created_datetime.isoformat() if r.created_datetime else None
         } for r in reports]
 
@@ -215,7 +243,7 @@ async def get_search_history(session: AsyncSession = Depends(get_session)):
 # -------------------------------------- Delete routes ----------------------------------
 
 @router.delete('/report/{id}')
-async def delete_report(id: int, session: AsyncSession = Depends(get_session)):
+async def delete_report(id: int, session: AsyncSession = Depends(get_write_session)):
     '''
         This function delete history reports.
     '''
@@ -1,22 +1,33 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+import httpx
 
 from backend.api.v1.routes import router as api_router
 from backend.database.db import init_db
-
-# Create FastAPI instance
-app = FastAPI()
+from backend.agent.content_extractor import DEFAULT_HEADERS, create_pdf_executor
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: init db
+    # Startup: init db and a shared HTTP/2 client so connections are reused across requests
     await init_db()
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=15,
+        follow_redirects=True,
+        headers=DEFAULT_HEADERS,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+    app.state.pdf_executor = create_pdf_executor()
     yield
-    # Shutdown: cleanup (if needed)
+    # Shutdown: cleanup
+    await app.state.http.aclose()
+    app.state.pdf_executor.shutdown(wait=False, cancel_futures=True)
     print("App shutting down...")
 
-app = FastAPI(lifespan=lifespan)
+# Create FastAPI instance
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Add middleware for CORS
 app.add_middleware(
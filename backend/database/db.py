@@ -1,94 +1,162 @@
 from sqlmodel import SQLModel, create_engine, Session, Column, TIMESTAMP, text, JSON, Field
 from pydantic import BaseModel
 
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from contextlib import asynccontextmanager
+from dotenv import load_dotenv
 
 from typing import List, Dict, Annotated, Any, Optional, AsyncGenerator
 from datetime import datetime
-import json
+import asyncio
+import os
+import orjson
 
 # Change SQLite URL to async version
 DATABASE_URL = 'sqlite+aiosqlite:///./test.db'
-
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Statement logging formats every bound JSON payload, so it is opt-in. The engines are built
+# at import, so .env has to be loaded here rather than relying on a later load_dotenv()
+load_dotenv()
+SQL_ECHO = os.getenv('SQL_ECHO', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _orjson_dumps(obj: Any) -> str:
+    """Serialize to a JSON string with orjson (which returns bytes)."""
+    # Search results are keyed by integer result id, which stdlib json also allowed
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+# SQLite allows a single writer at a time, so all writes share one connection guarded by
+# _write_lock, while reads use a pool of connections (WAL lets them run alongside the writer)
+write_engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO, future=True,
+                                   json_serializer=_orjson_dumps, json_deserializer=orjson.loads,
+                                   poolclass=StaticPool, connect_args={'check_same_thread': False})
+read_engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO, future=True,
+                                  json_serializer=_orjson_dumps, json_deserializer=orjson.loads,
+                                  pool_size=10, max_overflow=20)
+
+writer_session = sessionmaker(write_engine, class_=AsyncSession, expire_on_commit=False)
+reader_session = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+_write_lock = asyncio.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_conn, _):
+    """Use WAL so readers are not blocked by writers, and tune caching for each new connection."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-64000')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
+if ':memory:' not in DATABASE_URL:
+    for _engine in (write_engine, read_engine):
+        event.listen(_engine.sync_engine, 'connect', _set_sqlite_pragmas)
+
+def _create_schema(sync_conn):
+    SQLModel.metadata.create_all(sync_conn)
+    # create_all only builds indexes along with new tables, so add any missing ones to existing tables
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
-
-
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    """Yield an async session for database operations."""
-    async with async_session() as session:
-        try:
-            yield session
-            await session.commit()
-        except Exception as e:
-            await session.rollback()
-            raise e
+    async with write_engine.begin() as conn:
+        await conn.run_sync(_create_schema)
+
+
+@asynccontextmanager
+async def exclusive_write_session() -> AsyncGenerator[AsyncSession, None]:
+    """Open a session on the writer connection, holding the write lock until it is committed."""
+    async with _write_lock:
+        async with writer_session() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+
+async def bulk_insert(session: AsyncSession, model: type[SQLModel], rows: List[Dict[str, Any]],
+                      ignore_conflicts: bool = False):
+    """Insert many rows of a table with a single executemany and one commit. With ignore_conflicts,
+    rows whose key already exists are skipped instead of failing the whole batch."""
+    if not rows:
+        return
+    statement = insert(model)
+    if ignore_conflicts:
+        statement = statement.on_conflict_do_nothing()
+    await session.execute(statement, rows)
+    await session.commit()
+
+
+async def get_write_session() -> AsyncGenerator[AsyncSession, None]:
+    """Yield a session for database writes."""
+    async with exclusive_write_session() as session:
+        yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """Yield a session for database reads."""
+    async with reader_session() as session:
+        yield session
 
 class ReportHistory(SQLModel, table=True):
     __tablename__ = 'reports'
+    # Fetch server-side defaults (id, created_datetime) with INSERT ... RETURNING on flush
+    __mapper_args__ = {'eager_defaults': True}
 
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str = Field(..., description='The title of the report')
     detailed_summary: str = Field(..., description="A detailed summary of the report in at least 500 words")
-    links: Dict[str, str] = Field(default_factory=dict, description="A dictionary of urls used to generate report",
+    links: Dict[str, Any] = Field(default_factory=dict, description="A dictionary of urls used to generate report",
                                   sa_column=Column(JSON))
     created_datetime: datetime= Field(
                                     sa_column=Column(
                                         TIMESTAMP(timezone=True),
                                         nullable=False,
-                                        server_default=text('CURRENT_TIMESTAMP')
+                                        server_default=text('CURRENT_TIMESTAMP'),
+                                        index=True
                                     )
                                 )
-    
-    def set_links(self, links_dict: Dict[str, str]):
-        """Convert dictionary to JSON string before storing"""
-        self.links = json.dumps(links_dict)
-
-    def get_links(self) -> Dict[str, str]:
-        """Convert stored JSON string back to dictionary"""
-        return json.loads(self.links)
 
 
 class SearchHistory(SQLModel, table=True):
     __tablename__ = "searches"
+    __mapper_args__ = {'eager_defaults': True}
     id: Optional[int] = Field(default=None, primary_key=True)
-    query: str = Field(..., description="User's request for report")
-    search_results: str = Field(
-        default="{}",
-        description="JSON string of search results",
+    query: str = Field(..., index=True, description="User's request for report")
+    search_results: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Search results used for the report",
         sa_column=Column(JSON)
     )
-    extracted_contents: str = Field(
-        default="{}",
-        description="JSON string of extracted contents",
+    extracted_contents: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Extracted contents keyed by url",
         sa_column=Column(JSON)
     )
     created_datetime: datetime = Field(
         sa_column=Column(
             TIMESTAMP(timezone=True),
             nullable=False,
-            server_default=text("CURRENT_TIMESTAMP")
+            server_default=text("CURRENT_TIMESTAMP"),
+            index=True
         )
     )
 
-    def set_search_results(self, results: dict):
-        """Convert dictionary to JSON string before storing"""
-        self.search_results = json.dumps(results)
-
-    def get_search_results(self) -> dict:
-        """Convert stored JSON string back to dictionary"""
-        return json.loads(self.search_results)
-
-    def set_extracted_contents(self, contents: dict):
-        """Convert dictionary to JSON string before storing"""
-        self.extracted_contents = json.dumps(contents)
 
-    def get_extracted_contents(self) -> dict:
-        """Convert stored JSON string back to dictionary"""
-        return json.loads(self.extracted_contents)
+class CachedSummary(SQLModel, table=True):
+    __tablename__ = "summary_cache"
+    chunk_hash: str = Field(primary_key=True, description="blake2b hex digest of the model, prompt version and chunk text")
+    summary: str = Field(..., description="LLM summary of the chunk")
+    created_datetime: datetime = Field(
+        sa_column=Column(
+            TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=text("CURRENT_TIMESTAMP")
+        )
+    )
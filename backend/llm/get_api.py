@@ -3,4 +3,11 @@ import os
 
 load_dotenv()
 def load_apikey():
-    return os.getenv('GROQ_API_KEY', '')
\ No newline at end of file
+    return os.getenv('GROQ_API_KEY', '')
+
+def load_condense_model():
+    return os.getenv('CONDENSE_MODEL', 'llama-3.1-8b-instant')
+
+def load_max_request_tokens():
+    # Largest single request the Groq deployment accepts (the free tier allows 6000 tokens per minute)
+    return int(os.getenv('MAX_REQUEST_TOKENS', '6000'))
@@ -1,14 +1,118 @@
 from langchain_groq import ChatGroq
+from groq import APIStatusError
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from pydantic import BaseModel, Field
-from typing import List, Optional, Annotated, Dict, Any, ClassVar
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import List, Optional, Annotated, Dict, Any, ClassVar, AsyncIterator, Tuple
 import re
+import asyncio
+import hashlib
+import random
+from functools import lru_cache
+import tiktoken
+from sqlmodel import select
 
-from backend.llm.get_api import load_apikey
+from backend.llm.get_api import load_apikey, load_condense_model, load_max_request_tokens
+from backend.database.db import CachedSummary, bulk_insert, exclusive_write_session, reader_session
 
 groq_api_key = load_apikey()
+# Fail at startup rather than on every report request
+if not groq_api_key:
+    raise RuntimeError('GROQ_API_KEY environment variable is not set. Please set it first to generate report.')
+# Condensation is plain summarization, so it can run on a smaller, faster model
+condense_model = load_condense_model()
+report_model = "llama-3.1-8b-instant"
+
+# One client, and so one warm HTTP connection pool, per (model, temperature) shared by all reports
+_GROQ_CLIENTS: Dict[Tuple[str, float], ChatGroq] = {}
+
+
+def _get_groq(model: str, temperature: float) -> ChatGroq:
+    key = (model, temperature)
+    client = _GROQ_CLIENTS.get(key)
+    if client is None:
+        client = ChatGroq(model=model, api_key=groq_api_key, temperature=temperature)
+        _GROQ_CLIENTS[key] = client
+    return client
+
+
+# Number of chunks handed to one concurrent summarization batch
+_SUMMARY_BATCH_SIZE = 32
+
+# Runs of non-ASCII characters are replaced by a single space before chunking
+_RE_NON_ASCII = re.compile(r'[^\x00-\x7F]+')
+
+# cl100k_base is a close stand-in for the Llama tokenizer when sizing chunks
+_TOKEN_ENCODING = 'cl100k_base'
+
+# The reduce step sends every partial summary in one call, so they only need condensing when
+# they would not fit the deployment's request limit alongside the prompt and the report
+max_request_tokens = load_max_request_tokens()
+_RESERVED_TOKENS = 2048
+_MAX_PARTIALS_TOKENS = max_request_tokens - _RESERVED_TOKENS
+if _MAX_PARTIALS_TOKENS <= 0:
+    raise RuntimeError(f'MAX_REQUEST_TOKENS must be larger than the {_RESERVED_TOKENS} tokens reserved for the prompt and report.')
+# Chunks are summarized with the same prompt, so they have to fit that budget as well
+_CHUNK_TOKENS = min(3500, _MAX_PARTIALS_TOKENS)
+
+# Bound concurrent Groq calls across all reports to stay within rate limits: only as many
+# chunk-sized calls as the token budget covers run at once, and never more than 8
+llm_semaphore = asyncio.Semaphore(max(1, min(8, max_request_tokens // (_CHUNK_TOKENS + _RESERVED_TOKENS))))
+
+_PARTIALS_SEPARATOR = "\n---\n"
+
+# A rate-limited reduce call is retried unchanged; a smaller input would not help
+_MAX_RATE_LIMIT_RETRIES = 3
+_MAX_RATE_LIMIT_DELAY = 60
+
+
+# tiktoken downloads the encoding the first time it is loaded, so both are built on first use
+@lru_cache(maxsize=1)
+def _token_encoder() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(_TOKEN_ENCODING)
+
+
+@lru_cache(maxsize=1)
+def _text_splitter() -> RecursiveCharacterTextSplitter:
+    """Token-sized splitter shared by every report."""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=_TOKEN_ENCODING,
+        chunk_size=_CHUNK_TOKENS,
+        chunk_overlap=min(200, _CHUNK_TOKENS // 10),
+        separators=["\n\n", "\n", ".", " ", ""]
+    )
+
+
+def _count_tokens(text: str) -> int:
+    return len(_token_encoder().encode(text, disallowed_special=()))
+
+
+# Bump whenever REPORT_PROMPT or the report schema changes so stale cached summaries are not reused
+_SUMMARY_PROMPT_VERSION = 1
+# Cache keys cover the model and prompt version as well as the chunk text
+_CHUNK_HASH_SEED = hashlib.blake2b(f'{report_model}:{_SUMMARY_PROMPT_VERSION}\n'.encode(), digest_size=16)
+
+
+def _is_request_too_large(error: APIStatusError) -> bool:
+    """Whether Groq rejected a request for its size. Rate limits (429) are not size errors."""
+    return error.status_code == 413 or 'context_length_exceeded' in str(error)
+
+
+def _retry_after_seconds(error: APIStatusError, attempt: int) -> float:
+    """Delay before retrying a rate-limited call: Groq's Retry-After, else exponential backoff."""
+    try:
+        delay = float(error.response.headers.get('retry-after', ''))
+    except ValueError:
+        delay = 2 ** attempt + random.random()
+    return min(max(delay, 0.0), _MAX_RATE_LIMIT_DELAY)
+
+
+def _chunk_hash(chunk: str) -> str:
+    """Key for the summary cache."""
+    digest = _CHUNK_HASH_SEED.copy()
+    digest.update(chunk.encode())
+    return digest.hexdigest()
 
 
 class ReportStructure(BaseModel):
@@ -17,6 +121,58 @@ class ReportStructure(BaseModel):
     links: Dict[str, str] = Field(default_factory=dict, description="A dictionary of urls used to generate report")
 
 
+# The report schema is static, so the parser and its format instructions are built once
+_PARSER = PydanticOutputParser(pydantic_object=ReportStructure)
+_FORMAT_INSTRUCTIONS = _PARSER.get_format_instructions()
+
+SYSTEM_PROMPT = '''
+    You are an expert in report generation. Generate a concise and informative report based on the provided
+    Researched Data.
+
+    The report should include bullet points if needed. Ensure clarity and coherence in the summary.
+    Use the following format:
+    title: <Title of the Report>
+    detailed_summary (in 500 to 800 words atleast)
+    links: dictionary of links {{url link: access denied/rejected with reason}}
+
+    Examples:
+        title: The Impact of Climate Change in Coastal Regions
+        detailed_summary: .....
+        links: {{
+            'url link': 'Link Accessed',
+            'url link': Reason why access failed
+        }}
+
+        title: Advances in Artificial Intelligence and Machine Learning
+        detailed_summary: .....
+        links: {{
+            'url link': 'Link Accessed',
+            'url link': Reason why access failed
+        }}
+
+    Instructions : {instructions}
+'''
+# Static instructions (including the schema-derived format instructions) form a stable
+# system-message prefix shared by every call, so the provider can cache it; only the
+# per-chunk data in the human message changes between calls.
+REPORT_PROMPT = ChatPromptTemplate.from_messages([
+    ('system', SYSTEM_PROMPT),
+    ('human', 'Researched Data : {data}\nReport: <Report>'),
+]).partial(instructions=_FORMAT_INSTRUCTIONS)
+
+CONDENSATION_PROMPT = '''
+    You are an expert in text summarization. Your task is to take the following text
+    and create a concise, condensed summary of it. The goal is to reduce the overall length
+    while preserving the key information.
+
+    Do not add any extra information, titles, or formatting. Only return the summarized text.
+'''
+CONDENSE_PROMPT = ChatPromptTemplate.from_messages([
+    ('system', CONDENSATION_PROMPT),
+    ('human', 'Original Text: {data}\nCondensed Summary:'),
+])
+
+
 class ReportGenerator(BaseModel):
     '''
        ReportGenerator class is used to generate summaries of the parsed data from urls.
@@ -25,113 +181,152 @@ class ReportGenerator(BaseModel):
 
     '''
     api_key: ClassVar[str] = groq_api_key
+    # Chains are built once per temperature and reused for every chunk
+    _chains: Dict[float, Any] = PrivateAttr(default_factory=dict)
+    _condensation_chains: Dict[float, Any] = PrivateAttr(default_factory=dict)
 
     @staticmethod
-    async def _chunk_data(data: Dict[str, Any], chunk_size: int = 6000, chunk_overlap: int = 300) -> List[str]:
+    async def _iter_chunks(data: Dict[str, Any]) -> AsyncIterator[str]:
         """
-        Splits the extracted contents dictionary into smaller text chunks.
+        Yields text chunks from the extracted contents dictionary, one source at a time.
 
         Args:
             data: Dictionary with urls -> {"text": "...", "source": "..."}
-            chunk_size: Max chunk size in characters (approx tokens).
-            chunk_overlap: Overlap between chunks.
 
-        Returns:
-            List[str]: List of text chunks.
+        Yields:
+            str: The next text chunk.
         """
         def clean_text(text: str) -> str:
-            # Keep normal punctuation for coherence; only strip weird control characters
-            return re.sub(r'[^\x00-\x7F]+', ' ', text)
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", " ", ""]
-        )
+            # Keep normal punctuation for coherence; only strip weird control characters.
+            # str.isascii() is a C-level scan, so pure-ASCII pages skip the regex entirely
+            return text if text.isascii() else _RE_NON_ASCII.sub(' ', text)
 
-        print('Combining data into one big string...')
-        all_texts = []
+        # Each source is split on its own so the whole corpus is never joined into one string
         for url, content in data.items():
             if isinstance(content, dict) and "text" in content:
-                all_texts.append(clean_text(content["text"]))
+                text = content["text"]
             elif isinstance(content, str):
-                all_texts.append(clean_text(content))
-
-        combined_text = "\n\n".join(all_texts)
-        print('Data combined.')
-
-        return text_splitter.split_text(combined_text)
+                text = content
+            else:
+                continue
+            for chunk in _text_splitter().split_text(clean_text(text)):
+                yield chunk
 
     async def _get_chain(self, temperature = 0.2):
-        if not groq_api_key:
-            raise ValueError('GROQ_API_KEY enironment variable is not set. Please set it first to generate report.')
-        
-        groq = ChatGroq(model= "llama-3.1-8b-instant",
-                        api_key= self.api_key,
-                        temperature= temperature)
-        
-        parser = PydanticOutputParser(pydantic_object=ReportStructure)
-
-        SYSTEM_PROMPT = '''
-            You are an expert in report generation. Generate a concise and informative report based on the provided
-            Researched Data.
-
-            The report should include bullet points if needed. Ensure clarity and coherence in the summary.
-            Use the following format:
-            title: <Title of the Report>
-            detailed_summary (in 500 to 800 words atleast)
-            links: dictionary of links {{url link: access denied/rejected with reason}}
-
-            Examples:
-                title: The Impact of Climate Change in Coastal Regions
-                detailed_summary: .....
-                links: {{
-                    'url link': 'Link Accessed',
-                    'url link': Reason why access failed
-                }}
-
-                title: Advances in Artificial Intelligence and Machine Learning
-                detailed_summary: .....
-                links: {{
-                    'url link': 'Link Accessed',
-                    'url link': Reason why access failed
-                }}
-
-            Instructions : {instructions}
-
-            Researched Data : {data}
-            Report: <Report>
-        '''
-        prompt = PromptTemplate(template = SYSTEM_PROMPT,
-                                input_variables = ['instructions', 'data'])
-
-        # parser = StructuredOuputParser.from_response_schema()
-        chain = prompt | groq | parser
+        chain = self._chains.get(temperature)
+        if chain is None:
+            groq = _get_groq(report_model, temperature)
+            chain = REPORT_PROMPT | groq | _PARSER
+            self._chains[temperature] = chain
         return chain
 
 
     async def _get_condensation_chain(self, temperature=0.2):
         """A separate chain for creating more concise summaries during re-summarization."""
-        if not groq_api_key:
-            raise ValueError('GROQ_API_KEY environment variable is not set.')
-
-        groq = ChatGroq(model="llama-3.1-8b-instant", api_key=self.api_key, temperature=temperature)
-
-        CONDENSATION_PROMPT = '''
-            You are an expert in text summarization. Your task is to take the following text
-            and create a concise, condensed summary of it. The goal is to reduce the overall length
-            while preserving the key information.
+        chain = self._condensation_chains.get(temperature)
+        if chain is None:
+            groq = _get_groq(condense_model, temperature)
+            chain = CONDENSE_PROMPT | groq
+            self._condensation_chains[temperature] = chain
+        return chain
 
-            Do not add any extra information, titles, or formatting. Only return the summarized text.
 
-            Original Text: {data}
-            Condensed Summary:
-        '''
-        prompt = PromptTemplate(template=CONDENSATION_PROMPT, input_variables=['data'])
+    @staticmethod
+    async def _load_cached_summaries(hashes: List[str]) -> Dict[str, str]:
+        """Fetch previously generated summaries for the given chunk hashes."""
+        try:
+            async with reader_session() as session:
+                result = await session.execute(
+                    select(CachedSummary).where(CachedSummary.chunk_hash.in_(set(hashes))))
+                return {row.chunk_hash: row.summary for row in result.scalars()}
+        except Exception as cache_error:
+            print(f"⚠️ Summary cache lookup failed: {cache_error}")
+            return {}
 
-        chain = prompt | groq
-        return chain
+    @staticmethod
+    async def _store_cached_summaries(summaries: Dict[str, str]):
+        """Persist new chunk summaries in a single batched insert."""
+        if not summaries:
+            return
+        try:
+            async with exclusive_write_session() as session:
+                # Chunks a concurrent report already cached are skipped rather than failing the batch
+                await bulk_insert(session, CachedSummary,
+                                  [{"chunk_hash": h, "summary": summary} for h, summary in summaries.items()],
+                                  ignore_conflicts=True)
+        except Exception as cache_error:
+            # The cache is best-effort; a failed write only costs a later cache miss
+            print(f"⚠️ Summary cache write failed: {cache_error}")
+
+    async def _summarize_chunks(self, chain, chunks: List[str]) -> List[str]:
+        """Summarize chunks concurrently with the report chain, reusing cached summaries and
+        skipping chunks that fail."""
+        hashes = [_chunk_hash(chunk) for chunk in chunks]
+        cached = await self._load_cached_summaries(hashes)
+        print(f"Summary cache hits: {len(set(hashes) & cached.keys())}/{len(set(hashes))}")
+
+        async def _summarize(i: int, chunk: str) -> str:
+            async with llm_semaphore:
+                response: ReportStructure = await chain.ainvoke({"data": {"chunk_text": chunk}})
+            print(f"✔️ Finished chunk {i}/{len(chunks)}")
+            return response.detailed_summary
+
+        # Only call the LLM for uncached chunks, and only once per distinct chunk
+        pending = {h: (i, chunk) for i, (chunk, h) in enumerate(zip(chunks, hashes), 1) if h not in cached}
+        results = await asyncio.gather(*[_summarize(i, chunk) for i, chunk in pending.values()],
+                                       return_exceptions=True)
+        fresh = {}
+        for (h, (i, _)), result in zip(pending.items(), results):
+            if isinstance(result, Exception):
+                print(f"⚠️ Error processing chunk {i}: {result}")
+            else:
+                fresh[h] = result
+        await self._store_cached_summaries(fresh)
+
+        summaries = {**cached, **fresh}
+        return [summaries[h] for h in hashes if h in summaries]
+
+    async def _condense_chunks(self, chain, chunks: List[str]) -> List[str]:
+        """Condense chunks concurrently with the condensation chain, skipping chunks that fail."""
+        async def _condense(i: int, chunk: str) -> str:
+            async with llm_semaphore:
+                # The condensation chain returns a message; its 'content' attribute holds the text
+                response = await chain.ainvoke({"data": chunk})
+            print(f"✔️ Finished re-summarizing chunk {i}/{len(chunks)}")
+            return response.content
+
+        results = await asyncio.gather(*[_condense(i, chunk) for i, chunk in enumerate(chunks, 1)],
+                                       return_exceptions=True)
+        summaries = []
+        for i, result in enumerate(results, 1):
+            if isinstance(result, Exception):
+                print(f"⚠️ Error processing re-summary chunk {i}: {result}")
+            else:
+                summaries.append(result)
+        return summaries
+
+    async def _condense_partials(self, partials: str, temperature: float) -> str:
+        """Run one condensation pass over the joined partial summaries; fails if any chunk does."""
+        new_chunks = _text_splitter().split_text(partials)
+        condensation_chain = await self._get_condensation_chain(temperature=temperature)
+        condensed = await self._condense_chunks(condensation_chain, new_chunks)
+        # A dropped chunk would shrink the text by losing content, not by condensing it
+        if len(condensed) < len(new_chunks):
+            raise RuntimeError(f'{len(new_chunks) - len(condensed)} of {len(new_chunks)} condensation calls failed.')
+        return _PARTIALS_SEPARATOR.join(condensed)
 
+    @staticmethod
+    async def _reduce(chain, partials: str) -> ReportStructure:
+        """Generate the final report, waiting out rate limits and retrying with the same input."""
+        for attempt in range(_MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                return await chain.ainvoke({"data": {"partials": partials}})
+            except APIStatusError as api_error:
+                if api_error.status_code != 429 or attempt == _MAX_RATE_LIMIT_RETRIES:
+                    raise
+                delay = _retry_after_seconds(api_error, attempt)
+                print(f"Final report request rate-limited. Retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
 
     async def generate_report(self, data: Dict[str, Any], temperature = 0.2) -> Dict[str, str]:
         '''
@@ -149,63 +344,51 @@ class ReportGenerator(BaseModel):
                 - error: Error message if generation fails
         
         Raises:
-            ValueError: If API key is missing or invalid
+            ValueError: If the API key is invalid
             Exception: For other unexpected errors during report generation
         '''
         try:
-            # 1. Initial chunking and summarization
-            chunks = await self._chunk_data(data['extracted_contents'])
-            print(f"Total chunks to summarize: {len(chunks)}")
-
+            # 1. Stream chunks and summarize them in concurrent batches
+            chain = await self._get_chain(temperature=temperature)
             partial_summaries = []
-            for i, chunk in enumerate(chunks, 1):
-                chain = await self._get_chain(temperature=temperature)
-                try:
-                    response: ReportStructure = await chain.ainvoke({
-                        "data": {"chunk_text": chunk},
-                        "instructions": PydanticOutputParser(pydantic_object=ReportStructure).get_format_instructions()
-                    })
-                    partial_summaries.append(response.detailed_summary)
-                    print(f"✔️ Finished chunk {i}/{len(chunks)}")
-                except Exception as chunk_error:
-                    print(f"⚠️ Error processing chunk {i}: {chunk_error}")
-                    # Optionally skip this chunk or handle the error in another way
-                    continue
-
-            # 2. Iteratively summarize until the content is small enough
-            combined_summary = "\n\n".join(partial_summaries)
-            # Define a max length, e.g., based on the chunk size
-            max_len = 6000
-
-          
-            while len(combined_summary) > max_len:
-                print(f"Combined summary is too long ({len(combined_summary)} chars). Summarizing further...")
-                # Create a new set of chunks from the oversized summary
-                new_chunks = await self._chunk_data({"combined": {"text": combined_summary}})
-                partial_summaries = [] # Reset for the new, more condensed summaries
-
-                for i, chunk in enumerate(new_chunks, 1):
-                    # Use the condensation chain for re-summarization
-                    chain = await self._get_condensation_chain(temperature=temperature)
+            batch = []
+            total_chunks = 0
+            async for chunk in self._iter_chunks(data['extracted_contents']):
+                batch.append(chunk)
+                if len(batch) == _SUMMARY_BATCH_SIZE:
+                    total_chunks += len(batch)
+                    partial_summaries.extend(await self._summarize_chunks(chain, batch))
+                    batch = []
+            if batch:
+                total_chunks += len(batch)
+                partial_summaries.extend(await self._summarize_chunks(chain, batch))
+            print(f"Total chunks summarized: {total_chunks}")
+            # Every chunk failed (or there was no text); reducing nothing would still yield a report
+            if not partial_summaries:
+                return {"error": f"No chunk summaries could be generated from {total_chunks} chunks."}
+
+            # 2. Reduce all partial summaries into the final report in a single call, condensing
+            # first if they overflow the request limit or Groq rejects the request as too large
+            partials = _PARTIALS_SEPARATOR.join(partial_summaries)
+            while True:
+                partials_tokens = _count_tokens(partials)
+                if partials_tokens <= _MAX_PARTIALS_TOKENS:
                     try:
-                        # The condensation chain returns a string directly
-                        response = await chain.ainvoke({"data": chunk})
-                        # Assuming the response object has a 'content' attribute with the text
-                        partial_summaries.append(response.content)
-                        print(f"✔️ Finished re-summarizing chunk {i}/{len(new_chunks)}")
-                    except Exception as chunk_error:
-                        print(f"⚠️ Error processing re-summary chunk {i}: {chunk_error}")
-                        continue
-                
-                combined_summary = "\n\n".join(partial_summaries)
-
-            # 3. Generate the final report from the condensed summary
-            print("Generating final report...")
-            chain = await self._get_chain(temperature=temperature)
-            final_report: ReportStructure = await chain.ainvoke({
-                "data": {"final_summary": combined_summary},
-                "instructions": PydanticOutputParser(pydantic_object=ReportStructure).get_format_instructions()
-            })
+                        print("Generating final report...")
+                        final_report: ReportStructure = await self._reduce(chain, partials)
+                        break
+                    except APIStatusError as api_error:
+                        if not _is_request_too_large(api_error):
+                            raise
+                        print(f"Final report request rejected ({api_error.status_code}). Condensing...")
+                else:
+                    print(f"Partial summaries are too long ({partials_tokens} tokens). Condensing...")
+
+                condensed = await self._condense_partials(partials, temperature)
+                # Stop rather than loop forever if condensing no longer shrinks the text
+                if not condensed or _count_tokens(condensed) >= partials_tokens:
+                    raise RuntimeError('Could not condense the partial summaries to fit the request limit.')
+                partials = condensed
 
             return final_report.model_dump()
 